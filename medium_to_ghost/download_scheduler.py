@@ -0,0 +1,279 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from medium_to_ghost.image_downloader import fetch_image, local_image_path
+
+logger = logging.getLogger(__name__)
+
+# Medium's CDN answers with one of these when we are sending requests too quickly
+THROTTLE_STATUS_CODES = {403, 429, 503}
+
+
+def parse_retry_after(value, now=None):
+    """
+    Parse an HTTP Retry-After header, which is either a number of seconds or an HTTP date.
+    :param value: Header value (or None if the response didn't have one)
+    :param now: Current unix time (only used for the date form)
+    :return: Number of seconds to wait, or None if the header is missing or unreadable
+    """
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+    return max(retry_at - (now if now is not None else time.time()), 0.0)
+
+
+class DownloadScheduler:
+    """
+    Downloads images on a pool of threads while keeping just below the rate where the server starts throttling us.
+
+    The number of downloads allowed in flight at once is tuned with AIMD (like TCP congestion control): every
+    successful, reasonably fast download grows the limit by about one per round of downloads, and a throttled,
+    failed or very slow download cuts it in half. Throttled urls are put back in the queue and retried after the
+    server's Retry-After delay (or an exponential backoff if it didn't send one).
+
+    Use it as a context manager. Leaving the with block waits for every submitted download to finish, unless it is
+    left because of an exception (i.e. Ctrl-C), in which case queued downloads are dropped.
+    """
+    def __init__(self, max_concurrency=8, min_concurrency=1, initial_concurrency=2, max_attempts=6,
+                 latency_target=10.0, backoff=1.0, max_wait=300.0):
+        """
+        :param max_concurrency: Most downloads to ever run at once (also the number of threads)
+        :param min_concurrency: Fewest downloads to allow at once, no matter how many errors we get
+        :param initial_concurrency: How many downloads to allow at once to begin with
+        :param max_attempts: How many times to try a url before giving up on it
+        :param latency_target: Downloads slower than this many seconds count as a sign of overload
+        :param backoff: Seconds to wait before the first retry when the server doesn't send Retry-After
+        :param max_wait: Never wait longer than this many seconds before a retry, whatever the server says
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, not {max_concurrency}")
+        if min_concurrency > max_concurrency:
+            raise ValueError(f"min_concurrency ({min_concurrency}) can't be more than max_concurrency ({max_concurrency})")
+
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.max_attempts = max_attempts
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.max_wait = max_wait
+
+        # Heap of (not_before, sequence, url, local_destination, attempt). The sequence number keeps
+        # downloads that are ready at the same time in submission order.
+        self.pending = []
+        self.sequence = itertools.count()
+        self.submitted = set()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.average_latency = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.threads = []
+
+        self.stats = {"downloaded": 0, "cached": 0, "throttled": 0, "retried": 0, "failed": 0}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+
+    def start(self):
+        """
+        Start the download threads.
+        :return: None
+        """
+        for _ in range(self.max_concurrency):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def close(self, cancel=False):
+        """
+        Wait for every submitted download to finish (or give up) and stop the download threads.
+        :param cancel: Drop every download that hasn't started yet (including retries) and only wait for the ones
+                       already in flight
+        :return: None
+        """
+        with self.condition:
+            if cancel:
+                self.pending = []
+            else:
+                while self.pending or self.in_flight:
+                    self.condition.wait()
+            self.closed = True
+            self.condition.notify_all()
+
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, url: str, cache_folder: Path):
+        """
+        Queue an image to be downloaded, unless it is already cached.
+        This has the same signature as download_image_with_local_cache() so it can be used in its place.
+        :param url: Image url to download
+        :param cache_folder: Where to cache the image
+        :return: The local path the image will be downloaded to
+        """
+        local_destination = local_image_path(url, cache_folder)
+
+        with self.condition:
+            if local_destination in self.submitted:
+                return local_destination
+            self.submitted.add(local_destination)
+
+        if local_destination.exists():
+            logger.debug(f"{local_destination} already exists. Using cached copy.")
+            with self.condition:
+                self.stats["cached"] += 1
+            logger.info(f"Image ready: {local_destination}", extra={"progress": "image"})
+            return local_destination
+
+        with self.condition:
+            heapq.heappush(self.pending, (0.0, next(self.sequence), url, local_destination, 1))
+            self.condition.notify()
+
+        return local_destination
+
+    def next_download(self):
+        """
+        Block until a download is allowed to start.
+        :return: (url, local_destination, attempt), or None once the scheduler is closed
+        """
+        with self.condition:
+            while True:
+                if self.closed:
+                    return None
+
+                now = time.monotonic()
+                wake_at = None
+                if self.pending and self.in_flight < int(self.concurrency):
+                    ready_at = max(self.pending[0][0], self.paused_until)
+                    if ready_at <= now:
+                        _, _, url, local_destination, attempt = heapq.heappop(self.pending)
+                        self.in_flight += 1
+                        return url, local_destination, attempt
+                    wake_at = ready_at
+
+                self.condition.wait(timeout=None if wake_at is None else wake_at - now)
+
+    def worker(self):
+        while True:
+            download = self.next_download()
+            if download is None:
+                return
+
+            url, local_destination, attempt = download
+            logger.debug(f"Downloading {url} to {local_destination} (attempt {attempt})")
+
+            started = time.monotonic()
+            try:
+                fetch_image(url, local_destination)
+            except HTTPError as e:
+                if e.code in THROTTLE_STATUS_CODES:
+                    retry_after = parse_retry_after(e.headers.get("Retry-After"))
+                    logger.debug(f"Throttled while downloading {url}. Retry-After: {retry_after}")
+                    self.finished(url, local_destination, attempt, error="throttled by server", retry=True,
+                                  throttled=True, retry_after=retry_after)
+                else:
+                    self.finished(url, local_destination, attempt, error=e.msg)
+            except (URLError, OSError) as e:
+                # Timeouts and dropped connections can also mean the server is overloaded, so back off and retry
+                self.finished(url, local_destination, attempt, error=str(e), retry=True)
+            except Exception as e:
+                # Never let a single bad url take down a download thread (close() would wait on it forever)
+                self.finished(url, local_destination, attempt, error=f"{type(e).__name__}: {e}")
+            else:
+                self.finished(url, local_destination, attempt, latency=time.monotonic() - started)
+
+    def finished(self, url, local_destination, attempt, latency=None, error=None, retry=False, throttled=False,
+                 retry_after=None):
+        """
+        Update the concurrency limit for a finished download attempt and requeue it if needed.
+        Everything happens under one lock so close() can never see an empty queue while a retry is on its way back.
+        :param url: Image url
+        :param local_destination: Where the image is being downloaded to
+        :param attempt: Which attempt this was (starting at 1)
+        :param latency: Seconds the download took, if it succeeded
+        :param error: Error message, if it failed
+        :param retry: True if the failure was a sign of overload that is worth retrying
+        :param throttled: True if the server explicitly told us to slow down
+        :param retry_after: Seconds the server asked us to wait before sending more requests
+        :return: None
+        """
+        now = time.monotonic()
+        gave_up = False
+
+        with self.condition:
+            self.in_flight -= 1
+
+            if error is None:
+                self.stats["downloaded"] += 1
+                self.average_latency = latency if self.average_latency is None else \
+                    0.8 * self.average_latency + 0.2 * latency
+                if latency > self.latency_target:
+                    self.decrease(now)
+                else:
+                    # Additive increase: about +1 for every round of 'concurrency' successful downloads
+                    self.concurrency = min(self.concurrency + 1 / self.concurrency, float(self.max_concurrency))
+            elif retry:
+                if throttled:
+                    self.stats["throttled"] += 1
+                if retry_after is not None:
+                    # The server told us how long to back off, and that applies to every request, not just this one
+                    self.paused_until = max(self.paused_until, now + min(retry_after, self.max_wait))
+                self.decrease(now)
+
+                if attempt < self.max_attempts:
+                    if retry_after is None:
+                        retry_after = self.backoff * 2 ** (attempt - 1)
+                    self.stats["retried"] += 1
+                    heapq.heappush(self.pending, (now + min(retry_after, self.max_wait), next(self.sequence), url,
+                                                  local_destination, attempt + 1))
+                else:
+                    error = f"{error} (gave up after {attempt} attempts)"
+                    gave_up = True
+            else:
+                gave_up = True
+
+            if gave_up:
+                self.stats["failed"] += 1
+            self.condition.notify_all()
+
+        if error is None:
+            logger.info(f"Image ready: {local_destination}", extra={"progress": "image"})
+        elif gave_up:
+            logger.error(f"Download failed for {local_destination}. Error Message: {error}",
+                         extra={"failure": {"kind": "image", "url": url, "path": str(local_destination),
+                                            "error": error}})
+
+    def decrease(self, now):
+        """
+        Multiplicative decrease. Requests that were already in flight when we backed off tend to fail together, so
+        only count one decrease per round trip instead of one per failed request.
+        :param now: Current time.monotonic()
+        :return: None
+        """
+        round_trip = self.average_latency if self.average_latency is not None else self.backoff
+        if now - self.last_decrease >= round_trip:
+            self.concurrency = max(self.concurrency / 2, float(self.min_concurrency))
+            self.last_decrease = now
+            logger.debug(f"Reducing download concurrency to {int(self.concurrency)}")
@@ -1,39 +1,84 @@
 import logging
+import shutil
 import urllib.request
 from urllib.error import HTTPError
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
 
-def download_image_with_local_cache(url: str, cache_folder: Path):
+# Send a User Agent so Medium doesn't return 403
+opener = urllib.request.build_opener()
+opener.addheaders = [('User-agent', 'medium_to_ghost post exporter')]
+
+DOWNLOAD_TIMEOUT = 60
+
+
+def image_cache_folder(slug):
     """
-    Download an image file locally if it doesn't already exist.
-    :param url: Image url to download
-    :param cache_folder: Where to cache the image
-    :return: The local path of the image (either downloaded or previously cached)
+    Get the folder a post's downloaded images are cached in.
+    :param slug: The post's slug
+    :return: Path of the post's image cache folder
     """
-    # Ensure cache folder exists
-    cache_folder.mkdir(parents=True, exist_ok=True)
+    return Path("exported_content") / "downloaded_images" / slug
 
-    # Send a User Agent so Medium doesn't return 403
-    opener = urllib.request.build_opener()
-    opener.addheaders = [('User-agent', 'medium_to_ghost post exporter')]
-    urllib.request.install_opener(opener)
-
-    logging.info(f"Downloading {url} to {cache_folder}")
 
+def local_image_path(url: str, cache_folder: Path):
+    """
+    Get the local filename an image url is cached under.
+    :param url: Image url
+    :param cache_folder: Where the image is cached
+    :return: Local path of the cached image
+    """
     filename = url.split("/")[-1]
     # Medium has stars (*) in image filenames but ghost doesn't like this
     filename = filename.replace("*", "-")
 
-    local_destination = cache_folder / filename
+    return cache_folder / filename
+
+
+def fetch_image(url: str, local_destination: Path):
+    """
+    Download an image, replacing anything already at local_destination. Errors (i.e. HTTPError) are raised.
+    :param url: Image url to download
+    :param local_destination: Where to save the image
+    :return: None
+    """
+    local_destination.parent.mkdir(parents=True, exist_ok=True)
+
+    # Download to a temporary name first so an interrupted download never leaves a partial file
+    # behind that looks like a valid cached copy next time.
+    partial_destination = local_destination.with_name(local_destination.name + ".part")
+    try:
+        with opener.open(url, timeout=DOWNLOAD_TIMEOUT) as response, open(partial_destination, "wb") as image_file:
+            shutil.copyfileobj(response, image_file)
+        partial_destination.replace(local_destination)
+    finally:
+        if partial_destination.exists():
+            partial_destination.unlink()
+
+
+def download_image_with_local_cache(url: str, cache_folder: Path):
+    """
+    Download an image file locally if it doesn't already exist.
+    :param url: Image url to download
+    :param cache_folder: Where to cache the image
+    :return: The local path of the image (either downloaded or previously cached)
+    """
+    logger.debug(f"Downloading {url} to {cache_folder}")
+
+    local_destination = local_image_path(url, cache_folder)
 
     if local_destination.exists():
-        logging.info(f"{local_destination} already exists. Using cached copy.")
+        logger.debug(f"{local_destination} already exists. Using cached copy.")
     else:
         try:
-            local_filename, headers = urllib.request.urlretrieve(url, local_destination)
+            fetch_image(url, local_destination)
         except HTTPError as e:
-            logging.error(f"Download failed for {local_destination}. Error Message: {e.msg}")
+            logger.error(f"Download failed for {local_destination}. Error Message: {e.msg}",
+                         extra={"failure": {"kind": "image", "url": url, "path": str(local_destination),
+                                            "error": e.msg}})
+            return local_destination
 
-    return local_destination
+    logger.info(f"Image ready: {local_destination}", extra={"progress": "image"})
 
+    return local_destination
@@ -0,0 +1,239 @@
+import click
+import json
+import logging
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from zipfile import ZipFile
+from medium_to_ghost.download_scheduler import DownloadScheduler
+from medium_to_ghost.image_downloader import image_cache_folder, local_image_path
+from medium_to_ghost.logging_config import configure_logging
+from medium_to_ghost.medium_post_parser import MediumHTMLParser, parse_medium_filename
+from medium_to_ghost.medium_to_ghost import create_ghost_import_zip, extract_posts_from_zip
+
+logger = logging.getLogger(__name__)
+
+# We only ever need to look at the first and last few bytes of an image to sanity check it, so even a
+# multi-GB cache can be checked without reading it all from disk.
+HEADER_SIZE = 32
+TRAILER_SIZE = 32
+
+
+def detect_image_problem(path: Path):
+    """
+    Check that a cached image file looks like a complete, valid image.
+    This only inspects the file header and trailer, not the full image data.
+    :param path: Path of the cached image
+    :return: None if the image looks fine, otherwise a short description of what is wrong with it
+    """
+    if not path.exists():
+        return "missing"
+
+    size = path.stat().st_size
+    if size == 0:
+        return "empty file"
+
+    with open(path, "rb") as image_file:
+        header = image_file.read(HEADER_SIZE)
+        image_file.seek(max(size - TRAILER_SIZE, 0))
+        trailer = image_file.read()
+
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        # Every PNG ends with an IEND chunk (plus its 4 byte checksum)
+        if b"IEND" not in trailer[-12:]:
+            return "truncated png"
+    elif header.startswith(b"\xff\xd8\xff"):
+        # JPEGs end with an End Of Image marker. Some encoders pad a few bytes after it.
+        if b"\xff\xd9" not in trailer:
+            return "truncated jpeg"
+    elif header.startswith(b"GIF87a") or header.startswith(b"GIF89a"):
+        if not trailer.endswith(b";"):
+            return "truncated gif"
+    elif header.startswith(b"RIFF") and header[8:12] == b"WEBP":
+        # The RIFF header stores the size of everything after the first 8 bytes
+        riff_size = struct.unpack("<I", header[4:8])[0]
+        if riff_size + 8 > size:
+            return "truncated webp"
+    elif header.lstrip().startswith(b"<svg") or header.lstrip().startswith(b"<?xml"):
+        if b"</svg>" not in trailer:
+            return "truncated svg"
+    else:
+        # Usually an html error page that was saved in place of the image
+        return "not an image"
+
+    return None
+
+
+def find_post_image_urls(posts):
+    """
+    Find the original url of every image in the Medium posts, keyed by where that image is cached locally.
+    :param posts: List of medium posts as dict with filename: html_content
+    :return: Dict of local image path: original image url
+    """
+    image_urls = {}
+
+    for name, content in posts.items():
+        try:
+            _, slug, _, _ = parse_medium_filename(name.split("/")[-1])
+        except ValueError:
+            # Not a post filename we know how to convert, so it can't have any downloaded images.
+            continue
+
+        try:
+            parser = MediumHTMLParser()
+            parser.feed(content)
+            cards = parser.convert()["cards"]
+        except Exception as e:
+            # A malformed post can't be converted either, so it has no images for us to check. Keep going.
+            logger.warning(f"Unable to find images in {name}. Error Message: {type(e).__name__}: {e}")
+            continue
+
+        for card_type, data in cards:
+            if card_type == "image":
+                image_urls[local_image_path(data["src"], image_cache_folder(slug))] = data["src"]
+
+    return image_urls
+
+
+def find_exported_image_paths(export_data):
+    """
+    Find the local path of every image card in the converted Ghost posts.
+    :param export_data: Dict version of the Ghost export file
+    :return: Set of local image paths
+    """
+    image_paths = set()
+
+    for post in export_data["db"][0]["data"]["posts"]:
+        mobiledoc = json.loads(post["mobiledoc"])
+        for card_type, data in mobiledoc["cards"]:
+            if card_type == "image":
+                # Undo the Ghost path rewrite done in convert_medium_post_to_ghost_json()
+                image_paths.add(Path(data["src"].replace("/content/images", "exported_content", 1)))
+
+    return image_paths
+
+
+def verify_images(image_paths, workers=16):
+    """
+    Check a set of cached images in parallel.
+    :param image_paths: Local image paths to check
+    :param workers: Number of threads to check files with
+    :return: Dict of local image path: problem description for every image that isn't fine
+    """
+    image_paths = sorted(image_paths)
+
+    with ThreadPoolExecutor(workers) as pool:
+        problems = pool.map(detect_image_problem, image_paths)
+
+    return {path: problem for path, problem in zip(image_paths, problems) if problem is not None}
+
+
+def repair_images(bad_images, image_urls, workers=16):
+    """
+    Throw away bad cached images and download them (and any missing images) again in parallel.
+    :param bad_images: Dict of local image path: problem description
+    :param image_urls: Dict of local image path: original image url
+    :param workers: Most images to download at once
+    :return: (list of repaired paths, dict of local image path: problem for images that couldn't be repaired)
+    """
+    repairable = [path for path in bad_images if path in image_urls]
+    unrepairable = {path: "original url unknown" for path in bad_images if path not in image_urls}
+
+    with DownloadScheduler(max_concurrency=workers) as scheduler:
+        for path in repairable:
+            if path.exists():
+                path.unlink()
+            scheduler.submit(image_urls[path], path.parent)
+
+    still_bad = verify_images(repairable, workers)
+
+    repaired = []
+    for path in repairable:
+        if path in still_bad:
+            unrepairable[path] = still_bad[path]
+        else:
+            repaired.append(path)
+
+    return repaired, unrepairable
+
+
+def build_report(expected_images, cached_images, bad_images, repaired=None, unrepaired=None):
+    """
+    Summarize an image cache check as a json-friendly dict.
+    :param expected_images: Set of image paths referenced by converted posts
+    :param cached_images: Set of image paths found in the cache folder
+    :param bad_images: Dict of local image path: problem description found by the check
+    :param repaired: Paths that were successfully downloaded again (None if no repair was attempted)
+    :param unrepaired: Dict of local image path: problem for images that still aren't fine
+    :return: Report dict
+    """
+    return {
+        "checked": len(expected_images),
+        "ok": len(expected_images) - len(bad_images),
+        "problems": {str(path): problem for path, problem in sorted(bad_images.items())},
+        "repaired": sorted(str(path) for path in repaired or []),
+        "unrepaired": {str(path): problem for path, problem in sorted((unrepaired or {}).items())},
+        # Cached files that no converted post points to. These are left alone.
+        "unreferenced": sorted(str(path) for path in cached_images - expected_images),
+    }
+
+
+@click.command()
+@click.argument('medium_export_zipfile')
+@click.option('-v', '--verbose', count=True, help="Show more log output. Repeat (-vv) for debug output.")
+@click.option('-q', '--quiet', is_flag=True, help="Only show errors.")
+@click.option('--workers', default=16, show_default=True, type=click.IntRange(min=1),
+              help="Number of threads to check and download images with.")
+@click.option('--repair/--no-repair', default=True, show_default=True,
+              help="Download bad or missing images again.")
+@click.option('--report', default="image_verification_report.json", show_default=True,
+              help="Where to write the json report.")
+def main(medium_export_zipfile, verbose, quiet, workers, repair, report):
+    """
+    Check the downloaded images from a previous medium_to_ghost run and re-download any that are bad or missing.
+    """
+    export_folder = Path("exported_content")
+    export_file = export_folder / "medium_export_for_ghost.json"
+
+    if not Path(medium_export_zipfile).exists() or not export_file.exists():
+        print(f"Unable to find {medium_export_zipfile} or {export_file} from a previous run.")
+        exit(1)
+
+    listener, _ = configure_logging(verbosity=-1 if quiet else verbose, show_progress=False)
+
+    try:
+        with ZipFile(medium_export_zipfile) as medium_zip:
+            image_urls = find_post_image_urls(extract_posts_from_zip(medium_zip))
+
+        with open(export_file) as export:
+            expected_images = find_exported_image_paths(json.load(export))
+
+        cached_images = {path for path in (export_folder / "downloaded_images").glob("*/*") if path.is_file()}
+
+        bad_images = verify_images(expected_images, workers)
+        logger.info(f"Checked {len(expected_images)} images. {len(bad_images)} need to be downloaded again.")
+
+        repaired, unrepaired = None, bad_images
+        if repair and bad_images:
+            repaired, unrepaired = repair_images(bad_images, image_urls, workers)
+
+        # The Ghost import zip still has the old copies of the repaired images, so rebuild it
+        if repaired:
+            create_ghost_import_zip()
+    finally:
+        listener.stop()
+
+    results = build_report(expected_images, cached_images, bad_images, repaired, unrepaired)
+    with open(report, "w") as report_file:
+        json.dump(results, report_file, indent=2)
+
+    if not quiet:
+        print(f"Checked {results['checked']} images: {results['ok']} ok, {len(results['problems'])} bad or missing, "
+              f"{len(results['repaired'])} repaired, {len(results['unrepaired'])} still bad. See {report}.")
+
+    if results["unrepaired"]:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from pathlib import Path
+
+# Every module in this package logs to a child of this logger (i.e. 'medium_to_ghost.image_downloader'), so
+# configuring it here never touches the root logger of a program that imports this package.
+PACKAGE_LOGGER_NAME = "medium_to_ghost"
+
+
+class ProgressHandler(logging.Handler):
+    """
+    Draws a single live status line (posts/sec, images/sec and ETA) from log records that carry a
+    'progress' attribute set to either "post" or "image". Other records are ignored.
+    """
+    def __init__(self, stream=None, min_interval=0.5):
+        super().__init__()
+        self.stream = stream or sys.stderr
+        self.min_interval = min_interval
+        self.total_posts = None
+        self.posts = 0
+        self.images = 0
+        self.started_at = time.monotonic()
+        self.last_render = 0.0
+        self.line_visible = False
+
+    def start(self, total_posts):
+        """
+        Reset the counters for a new run.
+        :param total_posts: Number of posts we expect to process (used for the ETA)
+        :return: None
+        """
+        self.acquire()
+        try:
+            self.total_posts = total_posts
+            self.posts = 0
+            self.images = 0
+            self.started_at = time.monotonic()
+        finally:
+            self.release()
+
+    def emit(self, record):
+        kind = getattr(record, "progress", None)
+        if kind == "post":
+            self.posts += 1
+        elif kind == "image":
+            self.images += 1
+        else:
+            return
+
+        # Redrawing the line for every single record would cost more than the work we are reporting on
+        now = time.monotonic()
+        if now - self.last_render >= self.min_interval:
+            self.last_render = now
+            self.render()
+
+    def status_line(self):
+        """
+        Build the current status text.
+        :return: String like "12/40 posts | 3.1 posts/s | 9.8 images/s | ETA 9s"
+        """
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        posts_per_sec = self.posts / elapsed
+        images_per_sec = self.images / elapsed
+
+        if self.total_posts:
+            done = f"{self.posts}/{self.total_posts} posts"
+        else:
+            done = f"{self.posts} posts"
+
+        line = f"{done} | {posts_per_sec:.1f} posts/s | {self.images} images ({images_per_sec:.1f}/s)"
+
+        if self.total_posts and posts_per_sec > 0:
+            remaining = max(self.total_posts - self.posts, 0)
+            line += f" | ETA {remaining / posts_per_sec:.0f}s"
+
+        return line
+
+    def render(self):
+        self.stream.write("\r\x1b[K" + self.status_line())
+        self.stream.flush()
+        self.line_visible = True
+
+    def clear(self):
+        """
+        Erase the status line so a regular log message can be printed in its place.
+        :return: None
+        """
+        if self.line_visible:
+            self.stream.write("\r\x1b[K")
+            self.stream.flush()
+            self.line_visible = False
+
+    def finish(self):
+        """
+        Draw the final status line and move to a new line.
+        :return: None
+        """
+        self.acquire()
+        try:
+            self.render()
+            self.stream.write("\n")
+            self.stream.flush()
+            self.line_visible = False
+        finally:
+            self.release()
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """
+    A normal stream handler that gets out of the way of the live progress line (if there is one).
+    """
+    def __init__(self, stream=None, progress=None):
+        super().__init__(stream or sys.stderr)
+        self.progress = progress
+
+    def emit(self, record):
+        if self.progress is not None:
+            self.progress.clear()
+        super().emit(record)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Format a failure record as a single line of json so the error log can be replayed later.
+    """
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        entry.update(record.failure)
+        return json.dumps(entry)
+
+
+class JsonLinesErrorHandler(logging.FileHandler):
+    """
+    Write every record that carries a 'failure' dict (i.e. a post or image that couldn't be converted) to
+    a json-lines file. Everything else is ignored.
+    """
+    def __init__(self, filename, mode="w"):
+        super().__init__(filename, mode=mode, encoding="utf8")
+        self.addFilter(lambda record: hasattr(record, "failure"))
+        self.setFormatter(JsonLinesFormatter())
+
+
+def verbosity_to_level(verbosity):
+    """
+    Map the -v / -q command line count to a logging level.
+    :param verbosity: 0 is the default, positive numbers are more verbose and negative numbers are quieter
+    :return: A logging level
+    """
+    if verbosity <= -1:
+        return logging.ERROR
+    if verbosity == 0:
+        return logging.WARNING
+    if verbosity == 1:
+        return logging.INFO
+    return logging.DEBUG
+
+
+def configure_logging(verbosity=0, error_log_path=None, show_progress=None, log_queue=None, append_error_log=False):
+    """
+    Set up logging for a command line run.
+
+    Log calls only put records on a queue. A single background listener thread does the slow part (writing to
+    the console, drawing progress and writing the error log), so neither the main thread nor any worker threads
+    ever block on terminal output. Pass a multiprocessing queue as log_queue to share it with worker processes.
+
+    :param verbosity: 0 is the default, positive numbers are more verbose and negative numbers are quieter
+    :param error_log_path: Where to write the json-lines log of failed posts and images (None to disable)
+    :param show_progress: Draw a live progress line. Defaults to on for an interactive terminal at default verbosity.
+    :param log_queue: Queue shared with the listener. A new thread-safe queue is created if not given.
+    :param append_error_log: Add to an existing error log instead of starting a new one (used by --retry-failed)
+    :return: (QueueListener, ProgressHandler or None). Call listener.stop() when done to flush everything.
+    """
+    console_level = verbosity_to_level(verbosity)
+    if show_progress is None:
+        show_progress = verbosity == 0 and sys.stderr.isatty()
+
+    handlers = []
+
+    progress = None
+    if show_progress:
+        progress = ProgressHandler()
+        handlers.append(progress)
+
+    console = ConsoleHandler(progress=progress)
+    console.setLevel(console_level)
+    console.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    handlers.append(console)
+
+    if error_log_path is not None:
+        Path(error_log_path).parent.mkdir(parents=True, exist_ok=True)
+        handlers.append(JsonLinesErrorHandler(error_log_path, mode="a" if append_error_log else "w"))
+
+    if log_queue is None:
+        log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+
+    # Progress events are logged at INFO, so the logger itself has to let those through even when the
+    # console is only showing warnings.
+    logger = logging.getLogger(PACKAGE_LOGGER_NAME)
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(min(console_level, logging.INFO))
+    logger.propagate = False
+
+    listener.start()
+    return listener, progress
+
+
+def configure_worker_logging(log_queue, level=logging.INFO):
+    """
+    Point a worker process's package logger at the parent's log queue. Use as a process pool initializer.
+    :param log_queue: The same multiprocessing queue that was passed to configure_logging()
+    :param level: The parent's package logger level, so workers don't send records nobody will show
+    :return: None
+    """
+    logger = logging.getLogger(PACKAGE_LOGGER_NAME)
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(level)
+    logger.propagate = False
@@ -1,9 +1,10 @@
 from html.parser import HTMLParser
 import json
-from medium_to_ghost.image_downloader import download_image_with_local_cache
+from medium_to_ghost.image_downloader import download_image_with_local_cache, image_cache_folder
 from bs4 import BeautifulSoup
 import logging
-from pathlib import Path
+
+logger = logging.getLogger(__name__)
 
 
 def parse_medium_filename(filename):
@@ -24,14 +25,15 @@ def parse_medium_filename(filename):
     return uuid, slug, date, status
 
 
-def convert_medium_post_to_ghost_json(html_filename, post_html_content):
+def convert_medium_post_to_ghost_json(html_filename, post_html_content, image_downloader=download_image_with_local_cache):
     """
     Convert a Medium HTML export file's content into a Mobiledoc document.
     :param html_filename: The original filename from Medium (needed to grab publish state)
     :param post_html_content: The html body (string) of the post itself
+    :param image_downloader: Function(url, cache_folder) that downloads (or queues up) an image and returns its local path
     :return: Python dictionary representing a Mobiledoc version of this post
     """
-    logging.info(f"Parsing {html_filename}")
+    logger.debug(f"Parsing {html_filename}")
 
     # Get the publish date and slug from the exported filename
     _, filename = html_filename.split("/")
@@ -41,7 +43,8 @@ def convert_medium_post_to_ghost_json(html_filename, post_html_content):
     soup = BeautifulSoup(post_html_content, 'html.parser')
 
     # - Article Title
-    title = soup.find("h1", {"class": "p-name"}).text
+    title_h1 = soup.find("h1", {"class": "p-name"})
+    title = title_h1.text if title_h1 is not None else None
     if not title:
         title = "Empty title"
     # - Subtitle
@@ -64,7 +67,7 @@ def convert_medium_post_to_ghost_json(html_filename, post_html_content):
 
     # If there's no title element, this document is probably a comment. Skip!
     if title_el is None:
-        logging.warning(f"Skipping {html_filename} because it appears to be a Medium comment, not a post!")
+        logger.warning(f"Skipping {html_filename} because it appears to be a Medium comment, not a post!")
         return None
 
     # All the remaining document-evel attributes we need to collect
@@ -88,8 +91,7 @@ def convert_medium_post_to_ghost_json(html_filename, post_html_content):
             data = card[1]
             url = data["src"]
 
-            cache_folder = Path("exported_content") / "downloaded_images" / slug
-            new_image_path = download_image_with_local_cache(url, cache_folder)
+            new_image_path = image_downloader(url, image_cache_folder(slug))
 
             # TODO: Fix this when Ghost fixes https://github.com/TryGhost/Ghost/issues/9821
             # Ghost 2.0.3 has a bug where it doesn't update imported image paths, so manually add
@@ -188,6 +190,20 @@ class MediumHTMLParser(HTMLParser):
         # exported Mobiledoc file will look crappy.
         self.last_section_tag = None
 
+        # Medium also makes every line of a code block its own <pre>, so a long listing gets built up from thousands
+        # of small pieces. Appending those to the card's string one at a time copies the whole listing every time,
+        # so collect the pieces in a list and only join them into the card once the code block is finished.
+        self.code_buffer = None
+
+    def finish_code_block(self):
+        """
+        Join any buffered code into the current code card. Call this whenever a code block may have ended.
+        :return: None
+        """
+        if self.code_buffer is not None:
+            self.code_buffer[0]["code"] = "".join(self.code_buffer[1])
+            self.code_buffer = None
+
     def attrs_to_dict(self, attrs):
         """
         Convert an html attrs list into a dict
@@ -284,11 +300,13 @@ class MediumHTMLParser(HTMLParser):
             elif tag == "pre":
                 # If the last tag wasn't a <pre>, create a new code block
                 if self.last_section_tag != "pre":
+                    self.finish_code_block()
                     card = [
                         'code',
                         {"code": ""}
                     ]
                     self.cards.append(card)
+                    self.code_buffer = (card[1], [])
 
                     # 10 in Mobiledoc is the magic number for 'Card'
                     section = [10, len(self.cards) - 1]
@@ -296,7 +314,7 @@ class MediumHTMLParser(HTMLParser):
                 else:
                     # If the last section was a <pre>, just keep appending.
                     # We also need to add a line break between each appended <pre> to maintain formatting..
-                    self.cards[-1][1]["code"] += "\n\n"
+                    self.code_buffer[1].append("\n\n")
 
             # Some Medium embeds become <iframe> tags in the export file.
             # This includes things like embedded subscription forms or some kinds of external content.
@@ -322,7 +340,7 @@ class MediumHTMLParser(HTMLParser):
 
             # Handle Github gists in the Medium doc. They appear in the export as <script> tags.
             # So we'll create a Mobiledoc card element with a <script> tag that links to the same place as before.
-            elif tag == "script" and "gist.github.com" in attr_dict["src"]:
+            elif tag == "script" and "gist.github.com" in (attr_dict.get("src") or ""):
                 # Handle embedded gists
                 attr_strings = []
                 for k, v in attr_dict.items():
@@ -359,7 +377,7 @@ class MediumHTMLParser(HTMLParser):
 
                 if "pre" in self.tag_stack:
                     # - A <br> in a <pre> just needs to be appeneded to the current code block as a line break
-                    self.cards[-1][1]["code"] += "\n"
+                    self.code_buffer[1].append("\n")
                 else:
                     # - A <br> inside a <p>, <blockquote>, etc needs to be converted to a Mobiledoc "soft-return" atom.
                     atom = ["soft-return", "", {}]
@@ -436,6 +454,11 @@ class MediumHTMLParser(HTMLParser):
         if tag in ["p", "blockquote", "h3", "h4", "pre", "ol", "ul", "div"]:
             self.last_section_tag = tag
 
+            # Anything other than another <pre> means the current code block (if any) is complete. Tags nested
+            # inside a <pre> are still part of the code though.
+            if tag != "pre" and "pre" not in self.tag_stack:
+                self.finish_code_block()
+
         # Keep track of where we are in the DOM by popping this tag off the stack.
         # However, this function never gets closed for tags that don't have matching closing tags like
         # <img> and <br>, so we need to clear any of those out above this tag in the stack too.
@@ -464,7 +487,7 @@ class MediumHTMLParser(HTMLParser):
         # If we are nested inside a <pre>, we are dealing with code content. Just append it to the current code
         # card and bail.
         if "pre" in self.tag_stack:
-            self.cards[-1][1]["code"] += data
+            self.code_buffer[1].append(data)
             return
 
         # If we got this fair, we have regular HTML text that may or may not be nested inside a <strong>, <em>, etc tag.
@@ -496,6 +519,9 @@ class MediumHTMLParser(HTMLParser):
         Call this after calling .feed(html)
         :return:
         """
+        # The document may have ended in the middle of a code block
+        self.finish_code_block()
+
         return {
             "version": "0.3.1",
             "atoms": self.atoms,
@@ -1,14 +1,20 @@
 import click
 from pathlib import Path
 from medium_to_ghost.medium_post_parser import convert_medium_post_to_ghost_json
+from medium_to_ghost.logging_config import configure_logging, configure_worker_logging
+from medium_to_ghost.image_downloader import local_image_path
+from medium_to_ghost.download_scheduler import DownloadScheduler
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+import multiprocessing
 import time
 import json
 from zipfile import ZipFile
 import logging
-import sys
 import shutil
+import traceback
 
-logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 logger = logging.getLogger('medium_to_ghost')
 
 
@@ -41,20 +47,191 @@ def create_export_file(converted_posts):
     }
 
 
-def parse_posts(posts):
+def record_post_failure(name, error, error_traceback):
     """
-    Parse a list of Medium HTML posts
+    Log a post that couldn't be converted so it ends up in the json-lines error log (which --retry-failed reads).
+    :param name: Filename of the post inside the Medium export zip
+    :param error: The exception that was raised
+    :param error_traceback: Formatted traceback text for the exception
+    :return: None
+    """
+    failure = {
+        "kind": "post",
+        "post": name,
+        "error": f"{type(error).__name__}: {error}",
+        "traceback": error_traceback,
+    }
+    logger.error(f"Failed to convert {name}. Error Message: {failure['error']}", extra={"failure": failure})
+
+
+def convert_post(name, content):
+    """
+    Convert a single Medium post without letting a bad post take down the rest of the export.
+    This runs in a worker process when using --workers, so it must stay a module-level function.
+    Images aren't downloaded here. They are returned so they can all be handed to one shared DownloadScheduler.
+    :param name: Filename of the post inside the Medium export zip
+    :param content: The html body (string) of the post
+    :return: (Ghost version of the post or None if skipped, True if the conversion failed,
+              list of (image url, cache folder) to download)
+    """
+    images = []
+
+    def queue_image(url, cache_folder):
+        images.append((url, cache_folder))
+        return local_image_path(url, cache_folder)
+
+    try:
+        return convert_medium_post_to_ghost_json(name, content, image_downloader=queue_image), False, images
+    except Exception as e:
+        record_post_failure(name, e, traceback.format_exc())
+        return None, True, []
+
+
+def convert_posts_in_worker_processes(posts, workers, log_queue, finish_post):
+    """
+    Convert posts in a pool of worker processes, surviving workers that die outright (i.e. out of memory or a
+    segfault in a C extension).
+
+    When a worker dies, the pool is broken and every post still in it fails, not just the one that caused the crash.
+    So we never hand the pool more posts than it has workers. That way we know which posts were in flight when it
+    broke. Each of those is converted again on its own in a fresh single-worker pool, so only the post that really
+    crashes a worker gets marked as failed. The remaining posts carry on in a rebuilt pool.
+
     :param posts: List of medium posts as dict with filename: html_content
-    :return: Ghost versions of those same posts
+    :param workers: Number of worker processes to convert posts with
+    :param log_queue: Multiprocessing log queue the workers should log to
+    :param finish_post: Function(name, result) to call with the result of convert_post() for each post
+    :return: None
     """
-    converted_posts = []
+    initargs = (log_queue, logger.getEffectiveLevel())
+    pending = deque(posts.items())
 
-    for name, content in posts.items():
-        converted_post = convert_medium_post_to_ghost_json(name, content)
-        if converted_post is not None:
+    while pending:
+        in_flight_when_broken = []
+
+        with ProcessPoolExecutor(workers, initializer=configure_worker_logging, initargs=initargs) as pool:
+            running = {}
+            while (pending or running) and not in_flight_when_broken:
+                while pending and len(running) < workers:
+                    name, content = pending.popleft()
+                    running[pool.submit(convert_post, name, content)] = (name, content)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                # Once the pool breaks, every unfinished future fails at once, so check them all
+                if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                    done = list(running)
+
+                for future in done:
+                    name, content = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        in_flight_when_broken.append((name, content))
+                        continue
+                    except Exception as e:
+                        # i.e. the converted post couldn't be sent back from the worker
+                        record_post_failure(name, e, traceback.format_exc())
+                        result = (None, True, [])
+                    finish_post(name, result)
+
+        # Find out which of the posts that were in the pool when it broke is the one that kills a worker
+        for name, content in in_flight_when_broken:
+            with ProcessPoolExecutor(1, initializer=configure_worker_logging, initargs=initargs) as solo_pool:
+                try:
+                    result = solo_pool.submit(convert_post, name, content).result()
+                except Exception as e:
+                    record_post_failure(name, e, traceback.format_exc())
+                    result = (None, True, [])
+            finish_post(name, result)
+
+
+def parse_posts(posts, progress=None, workers=1, log_queue=None, max_downloads=8):
+    """
+    Parse a list of Medium HTML posts and download all their images
+    :param posts: List of medium posts as dict with filename: html_content
+    :param progress: Optional ProgressHandler to reset for this batch of posts (used for the ETA)
+    :param workers: Number of worker processes to convert posts with. 1 converts everything in this process.
+    :param log_queue: Multiprocessing log queue the workers should log to (required if workers > 1)
+    :param max_downloads: Most images to download at once. The scheduler backs off from this if Medium throttles us.
+    :return: (Ghost versions of those same posts, list of filenames of posts that failed to convert)
+    """
+    results = {}
+
+    if progress is not None:
+        progress.start(len(posts))
+
+    # Images download in the background while the remaining posts are still being converted
+    with DownloadScheduler(max_concurrency=max_downloads) as scheduler:
+        def finish_post(name, result):
+            results[name] = result
+            for url, cache_folder in result[2]:
+                scheduler.submit(url, cache_folder)
+            logger.info(f"Finished {name}", extra={"progress": "post"})
+
+        if workers > 1:
+            convert_posts_in_worker_processes(posts, workers, log_queue, finish_post)
+        else:
+            for name, content in posts.items():
+                finish_post(name, convert_post(name, content))
+
+    # Keep the original export order no matter what order the workers finished in
+    converted_posts = []
+    failed_posts = []
+    for name in posts:
+        converted_post, failed, _ = results[name]
+        if failed:
+            failed_posts.append(name)
+        elif converted_post is not None:
             converted_posts.append(converted_post)
 
-    return converted_posts
+    return converted_posts, failed_posts
+
+
+def load_failures(error_log):
+    """
+    Read every entry from a previous run's json-lines error log.
+    :param error_log: Path to the error log
+    :return: List of failure dicts (posts and images)
+    """
+    with open(error_log, encoding="utf8") as log_file:
+        return [json.loads(line) for line in log_file if line.strip()]
+
+
+def load_failed_post_names(error_log):
+    """
+    Read the names of posts that failed to convert from a previous run's json-lines error log.
+    :param error_log: Path to the error log
+    :return: Set of post filenames inside the Medium export zip
+    """
+    return {entry["post"] for entry in load_failures(error_log) if entry.get("kind") == "post"}
+
+
+def keep_failures_not_retried(error_log, retried_posts):
+    """
+    Rewrite an error log so it only keeps the failures a --retry-failed run isn't about to retry (failed images and
+    any failed posts that aren't in the zip). The retry run then appends its own failures after them.
+    :param error_log: Path to the error log
+    :param retried_posts: Filenames of the posts being converted again
+    :return: None
+    """
+    kept = [entry for entry in load_failures(error_log)
+            if not (entry.get("kind") == "post" and entry["post"] in retried_posts)]
+
+    with open(error_log, "w", encoding="utf8") as log_file:
+        for entry in kept:
+            log_file.write(json.dumps(entry) + "\n")
+
+
+def merge_posts(existing_posts, new_posts):
+    """
+    Add newly converted posts to the posts from an earlier export, replacing any earlier copy of the same post.
+    :param existing_posts: Ghost posts from a previous export file
+    :param new_posts: Newly converted Ghost posts
+    :return: Combined list of Ghost posts
+    """
+    new_uuids = {post["uuid"] for post in new_posts}
+    return [post for post in existing_posts if post["uuid"] not in new_uuids] + new_posts
 
 
 def extract_utf8_file_from_zip(zip, filename):
@@ -88,23 +265,67 @@ def extract_posts_from_zip(medium_zip):
 
 @click.command()
 @click.argument('medium_export_zipfile')
-def main(medium_export_zipfile):
+@click.option('-v', '--verbose', count=True, help="Show more log output. Repeat (-vv) for debug output.")
+@click.option('-q', '--quiet', is_flag=True, help="Only show errors.")
+@click.option('--error-log', default="medium_to_ghost_errors.jsonl", show_default=True,
+              help="Where to write a json-lines log of posts and images that failed to convert.")
+@click.option('--workers', default=1, show_default=True, type=click.IntRange(min=1),
+              help="Number of processes to convert posts with.")
+@click.option('--max-downloads', default=8, show_default=True, type=click.IntRange(min=1),
+              help="Most images to download at once. This is reduced automatically if Medium starts throttling.")
+@click.option('--retry-failed', is_flag=True,
+              help="Only convert the posts listed as failed in --error-log and add them to the previous export.")
+def main(medium_export_zipfile, verbose, quiet, error_log, workers, max_downloads, retry_failed):
+    if not Path(medium_export_zipfile).exists():
+        print(f"Unable to find {medium_export_zipfile}.")
+        exit(1)
+
     export_folder = Path("exported_content")
-    if Path(medium_export_zipfile).exists():
+    export_file = export_folder / "medium_export_for_ghost.json"
+
+    if retry_failed and (not Path(error_log).exists() or not export_file.exists()):
+        print(f"Nothing to retry. Unable to find {error_log} or {export_file} from a previous run.")
+        exit(1)
+
+    with ZipFile(medium_export_zipfile) as medium_zip:
+        posts = extract_posts_from_zip(medium_zip)
+
+    # A retry run only converts the failed posts again. Everything else in the old error log is kept and this
+    # run's failures are appended to it, so nothing from the original run is lost.
+    previous_posts = []
+    if retry_failed:
+        posts_to_retry = load_failed_post_names(error_log)
+        posts = {name: data for name, data in posts.items() if name in posts_to_retry}
+        keep_failures_not_retried(error_log, posts)
+        with open(export_file) as previous_export:
+            previous_posts = json.load(previous_export)["db"][0]["data"]["posts"]
+
+    log_queue = multiprocessing.Queue() if workers > 1 else None
+    listener, progress = configure_logging(verbosity=-1 if quiet else verbose, error_log_path=error_log,
+                                           log_queue=log_queue, append_error_log=retry_failed)
+
+    try:
         export_folder.mkdir(parents=True, exist_ok=True)
 
-        with ZipFile(medium_export_zipfile) as medium_zip, open(export_folder / "medium_export_for_ghost.json", "w") as output:
-            posts = extract_posts_from_zip(medium_zip)
-            exported_posts = parse_posts(posts)
-            export_data = create_export_file(exported_posts)
+        exported_posts, failed_posts = parse_posts(posts, progress, workers, log_queue, max_downloads)
+        export_data = create_export_file(merge_posts(previous_posts, exported_posts))
+
+        with open(export_file, "w") as output:
             json.dump(export_data, output, indent=2)
 
         # Put everything in a zip file for Ghost
         create_ghost_import_zip()
-        logger.info(f"Successfully created medium_export_for_ghost.zip. Upload this file to a Ghost 2.0+ instance!")
-    else:
-        print(f"Unable to find {medium_export_zipfile}.")
-        exit(1)
+    finally:
+        # Flush everything still sitting in the log queue before we print the final message
+        listener.stop()
+        if progress is not None:
+            progress.finish()
+
+    if failed_posts:
+        print(f"{len(failed_posts)} post(s) failed to convert. See {error_log} for details, then re-run with "
+              f"--retry-failed to convert just those posts.")
+    if not quiet:
+        print("Successfully created medium_export_for_ghost.zip. Upload this file to a Ghost 2.0+ instance!")
 
 
 if __name__ == "__main__":
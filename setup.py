@@ -22,7 +22,8 @@ setup(
     url='https://github.com/ageitgey/medium_to_ghost',
     entry_points={
         'console_scripts': [
-            'medium_to_ghost=medium_to_ghost.medium_to_ghost:main'
+            'medium_to_ghost=medium_to_ghost.medium_to_ghost:main',
+            'medium_to_ghost_verify_images=medium_to_ghost.image_verifier:main'
         ]
     },
     install_requires=requirements,
@@ -0,0 +1,170 @@
+import unittest
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from medium_to_ghost import download_scheduler
+
+
+class ThrottlingServer(ThreadingHTTPServer):
+    """
+    Local stand-in for Medium's CDN. Answers 429 whenever more than max_active requests are in flight at once
+    (or for the first throttle_first requests), and 404 for any path containing 'missing'.
+    """
+    daemon_threads = True
+
+    def __init__(self, max_active=1000, throttle_first=0, retry_after="0.05", delay=0.02):
+        super().__init__(("127.0.0.1", 0), ThrottlingRequestHandler)
+        self.max_active = max_active
+        self.throttle_first = throttle_first
+        self.retry_after = retry_after
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.requests = []
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}/{path}"
+
+
+class ThrottlingRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.requests.append((time.monotonic(), self.path))
+            throttle = server.active > server.max_active or len(server.requests) <= server.throttle_first
+
+        try:
+            if "missing" in self.path:
+                self.send_response(404)
+                self.end_headers()
+            elif throttle:
+                self.send_response(429)
+                if server.retry_after is not None:
+                    self.send_header("Retry-After", server.retry_after)
+                self.end_headers()
+            else:
+                time.sleep(server.delay)
+                body = f"image data for {self.path}".encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDownloadScheduler(unittest.TestCase):
+
+    def start_server(self, **kwargs):
+        server = ThrottlingServer(**kwargs)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache_folder = Path(self.tmp.name)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(download_scheduler.parse_retry_after("120"), 120.0)
+        self.assertEqual(download_scheduler.parse_retry_after("0.5"), 0.5)
+        self.assertAlmostEqual(download_scheduler.parse_retry_after(formatdate(1000030, usegmt=True), now=1000000), 30)
+        self.assertIsNone(download_scheduler.parse_retry_after(None))
+        self.assertIsNone(download_scheduler.parse_retry_after("soon"))
+
+    def test_backs_off_when_throttled_and_downloads_everything(self):
+        server = self.start_server(max_active=3)
+
+        with download_scheduler.DownloadScheduler(max_concurrency=12, initial_concurrency=12) as scheduler:
+            paths = [scheduler.submit(server.url(f"img/{i}.png"), self.cache_folder) for i in range(60)]
+
+        for i, path in enumerate(paths):
+            self.assertEqual(path.read_bytes(), f"image data for /img/{i}.png".encode("utf8"))
+        self.assertEqual(scheduler.stats["downloaded"], 60)
+        self.assertEqual(scheduler.stats["failed"], 0)
+        self.assertGreater(scheduler.stats["throttled"], 0)
+        # AIMD should settle around the server's limit, well below where we started
+        self.assertLess(scheduler.concurrency, 8)
+
+    def test_honors_retry_after(self):
+        server = self.start_server(throttle_first=1, retry_after="0.5")
+
+        with download_scheduler.DownloadScheduler(initial_concurrency=1) as scheduler:
+            path = scheduler.submit(server.url("img/a.png"), self.cache_folder)
+            scheduler.submit(server.url("img/b.png"), self.cache_folder)
+
+        self.assertTrue(path.exists())
+        self.assertEqual(scheduler.stats["throttled"], 1)
+        # The throttled request pauses every download, not just the one that was throttled
+        first_request_at = server.requests[0][0]
+        for requested_at, _ in server.requests[1:]:
+            self.assertGreaterEqual(requested_at - first_request_at, 0.45)
+
+    def test_gives_up_after_max_attempts(self):
+        server = self.start_server(max_active=0, retry_after="0")
+
+        with self.assertLogs("medium_to_ghost", level="ERROR") as logs:
+            with download_scheduler.DownloadScheduler(max_attempts=3) as scheduler:
+                path = scheduler.submit(server.url("img/a.png"), self.cache_folder)
+
+        self.assertFalse(path.exists())
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(scheduler.stats["failed"], 1)
+        self.assertEqual(logs.records[0].failure["url"], server.url("img/a.png"))
+
+    def test_does_not_retry_missing_images(self):
+        server = self.start_server()
+
+        with self.assertLogs("medium_to_ghost", level="ERROR"):
+            with download_scheduler.DownloadScheduler() as scheduler:
+                scheduler.submit(server.url("img/missing.png"), self.cache_folder)
+
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(scheduler.stats["retried"], 0)
+        self.assertEqual(scheduler.stats["failed"], 1)
+
+    def test_exception_drops_queued_downloads(self):
+        server = self.start_server(delay=0.2)
+
+        started = time.monotonic()
+        with self.assertRaises(KeyboardInterrupt):
+            with download_scheduler.DownloadScheduler(max_concurrency=2, initial_concurrency=2) as scheduler:
+                for i in range(50):
+                    scheduler.submit(server.url(f"img/{i}.png"), self.cache_folder)
+                raise KeyboardInterrupt()
+
+        # Only the downloads that were already running get to finish
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertLessEqual(len(server.requests), 2)
+        self.assertEqual(scheduler.pending, [])
+
+    def test_rejects_invalid_concurrency(self):
+        with self.assertRaises(ValueError):
+            download_scheduler.DownloadScheduler(max_concurrency=0)
+        with self.assertRaises(ValueError):
+            download_scheduler.DownloadScheduler(max_concurrency=2, min_concurrency=3)
+
+    def test_skips_cached_and_duplicate_images(self):
+        server = self.start_server()
+        (self.cache_folder / "cached.png").write_bytes(b"cached")
+
+        with download_scheduler.DownloadScheduler() as scheduler:
+            scheduler.submit(server.url("img/cached.png"), self.cache_folder)
+            scheduler.submit(server.url("img/new.png"), self.cache_folder)
+            scheduler.submit(server.url("img/new.png"), self.cache_folder)
+
+        self.assertEqual([path for _, path in server.requests], ["/img/new.png"])
+        self.assertEqual(scheduler.stats["cached"], 1)
+        self.assertEqual(scheduler.stats["downloaded"], 1)
@@ -0,0 +1,101 @@
+import unittest
+import json
+import os
+import tempfile
+import zlib
+import struct
+from pathlib import Path
+from medium_to_ghost import image_verifier
+
+
+def make_png():
+    """
+    Build a tiny but complete 1x1 png file.
+    """
+    def chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\x00\x00\x00")) +
+            chunk(b"IEND", b""))
+
+
+class TestImageVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.original_cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.original_cwd)
+        self.tmp.cleanup()
+
+    def write(self, path, data):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return path
+
+    def test_detect_image_problem(self):
+        png = make_png()
+
+        self.assertIsNone(image_verifier.detect_image_problem(self.write("ok.png", png)))
+        self.assertIsNone(image_verifier.detect_image_problem(self.write("ok.jpg", b"\xff\xd8\xff\xe0" + b"0" * 100 + b"\xff\xd9")))
+        self.assertEqual(image_verifier.detect_image_problem(Path("nope.png")), "missing")
+        self.assertEqual(image_verifier.detect_image_problem(self.write("empty.png", b"")), "empty file")
+        self.assertEqual(image_verifier.detect_image_problem(self.write("cut.png", png[:-20])), "truncated png")
+        self.assertEqual(image_verifier.detect_image_problem(self.write("cut.jpg", b"\xff\xd8\xff\xe0" + b"0" * 100)),
+                         "truncated jpeg")
+        self.assertEqual(image_verifier.detect_image_problem(self.write("error.png", b"<html>Forbidden</html>")),
+                         "not an image")
+
+    def test_verify_and_repair_images(self):
+        png = make_png()
+        source = self.write("source/1-abc.png", png)
+        source_url = source.resolve().as_uri()
+
+        cache = Path("exported_content") / "downloaded_images" / "test"
+        good = self.write(cache / "good.png", png)
+        corrupt = self.write(cache / "1-abc.png", png[:10])
+        missing = cache / "missing.png"
+        unreferenced = self.write(cache / "old.png", png)
+
+        export_data = {"db": [{"data": {"posts": [{"mobiledoc": json.dumps({"cards": [
+            ["image", {"src": f"/content/images/downloaded_images/test/{name}"}]
+            for name in ["good.png", "1-abc.png", "missing.png"]
+        ]})}]}}]}
+        expected_images = image_verifier.find_exported_image_paths(export_data)
+        self.assertEqual(expected_images, {good, corrupt, missing})
+
+        bad_images = image_verifier.verify_images(expected_images, workers=4)
+        self.assertEqual(bad_images, {corrupt: "truncated png", missing: "missing"})
+
+        repaired, unrepaired = image_verifier.repair_images(bad_images, {corrupt: source_url}, workers=4)
+        self.assertEqual(repaired, [corrupt])
+        self.assertEqual(unrepaired, {missing: "original url unknown"})
+        self.assertEqual(corrupt.read_bytes(), png)
+
+        report = image_verifier.build_report(expected_images, {good, corrupt, unreferenced}, bad_images, repaired,
+                                             unrepaired)
+        self.assertEqual(report["checked"], 3)
+        self.assertEqual(report["ok"], 1)
+        self.assertEqual(report["unreferenced"], [str(unreferenced)])
+
+    def test_find_post_image_urls(self):
+        posts = {
+            "posts/draft_test-7e48eb14931e.html":
+                '<html><body><img src="https://cdn-images-1.medium.com/max/800/1*abc.png"></body></html>',
+            "posts/not-a-post.html": '<html><body><img src="https://example.com/x.png"></body></html>',
+            # <a> without an href makes the parser raise KeyError
+            "posts/draft_broken-aaaaaaaaaaaa.html":
+                '<html><body><p><a>link</a></p><img src="https://example.com/y.png"></body></html>',
+        }
+
+        with self.assertLogs("medium_to_ghost", level="WARNING") as logs:
+            image_urls = image_verifier.find_post_image_urls(posts)
+
+        self.assertEqual(image_urls, {
+            Path("exported_content/downloaded_images/test/1-abc.png"): "https://cdn-images-1.medium.com/max/800/1*abc.png"
+        })
+        self.assertIn("posts/draft_broken-aaaaaaaaaaaa.html", logs.output[0])
@@ -0,0 +1,56 @@
+import unittest
+import io
+import json
+import logging
+import tempfile
+from pathlib import Path
+from medium_to_ghost import logging_config
+
+
+class TestLoggingConfig(unittest.TestCase):
+
+    def tearDown(self):
+        logger = logging.getLogger(logging_config.PACKAGE_LOGGER_NAME)
+        logger.handlers = []
+        logger.propagate = True
+
+    def test_verbosity_to_level(self):
+        self.assertEqual(logging_config.verbosity_to_level(-1), logging.ERROR)
+        self.assertEqual(logging_config.verbosity_to_level(0), logging.WARNING)
+        self.assertEqual(logging_config.verbosity_to_level(1), logging.INFO)
+        self.assertEqual(logging_config.verbosity_to_level(2), logging.DEBUG)
+
+    def test_failures_are_written_to_json_lines_error_log(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            error_log = Path(tmp) / "errors.jsonl"
+            listener, progress = logging_config.configure_logging(error_log_path=error_log, show_progress=False)
+
+            logger = logging.getLogger("medium_to_ghost.test")
+            logger.info("Not a failure")
+            logger.error("Download failed", extra={"failure": {"kind": "image", "url": "https://example.com/a.png"}})
+            listener.stop()
+            listener.handlers[-1].close()
+
+            lines = error_log.read_text().splitlines()
+
+        self.assertIsNone(progress)
+        self.assertEqual(len(lines), 1)
+        entry = json.loads(lines[0])
+        self.assertEqual(entry["kind"], "image")
+        self.assertEqual(entry["url"], "https://example.com/a.png")
+        self.assertEqual(entry["message"], "Download failed")
+
+    def test_progress_handler_counts_posts_and_images(self):
+        stream = io.StringIO()
+        progress = logging_config.ProgressHandler(stream=stream, min_interval=0)
+        progress.start(4)
+
+        logger = logging.getLogger("medium_to_ghost.test")
+        for kind in ["post", "image", "image", "post"]:
+            progress.handle(logger.makeRecord(logger.name, logging.INFO, __file__, 0, "", (), None,
+                                              extra={"progress": kind}))
+
+        self.assertEqual(progress.posts, 2)
+        self.assertEqual(progress.images, 2)
+        self.assertIn("2/4 posts", stream.getvalue())
+        self.assertIn("ETA", stream.getvalue())
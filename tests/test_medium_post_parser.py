@@ -3,6 +3,7 @@ import os
 from pathlib import Path
 from medium_to_ghost import medium_post_parser
 import json
+import time
 
 
 class TestMediumPostParser(unittest.TestCase):
@@ -54,4 +55,61 @@ class TestMediumPostParser(unittest.TestCase):
         self.assertEquals(result["title"], "Post Title")
         self.assertEquals(result["slug"], "test")
         self.assertEquals(result["status"], "draft")
-        self.assertEquals(result["mobiledoc"], expected_json)
\ No newline at end of file
+        self.assertEquals(result["mobiledoc"], expected_json)
+
+
+def build_large_code_post(line_count):
+    """
+    Build a Medium-style post with one huge code listing. Medium exports every line of a code block as its own <pre>.
+    """
+    line = "result = some_function(argument_one, argument_two)  # a fairly long line of code in a listing"
+    code = "".join(f"<pre>{line}<br>{line}</pre>" for _ in range(line_count))
+    return f"<html><body><section>{code}<p>After the code</p></section></body></html>"
+
+
+class TestMediumHTMLParserLargePosts(unittest.TestCase):
+
+    def parse_timed(self, html):
+        parser = medium_post_parser.MediumHTMLParser()
+        start = time.perf_counter()
+        parser.feed(html)
+        mobiledoc = parser.convert()
+        return mobiledoc, time.perf_counter() - start
+
+    def test_multi_megabyte_code_block(self):
+        html = build_large_code_post(20000)
+        self.assertGreater(len(html), 3 * 1024 * 1024)
+
+        mobiledoc, _ = self.parse_timed(html)
+
+        self.assertEqual(len(mobiledoc["cards"]), 1)
+        code = mobiledoc["cards"][0][1]["code"]
+        self.assertEqual(code.count("\n\n"), 20000 - 1)
+        self.assertEqual(code.count("some_function"), 40000)
+        self.assertEqual(mobiledoc["sections"][-1], [1, "p", [[0, [], 0, "After the code"]]])
+
+    def best_parse_time(self, html, runs=3):
+        # The fastest of several runs filters out garbage collection pauses and a busy machine
+        return min(self.parse_timed(html)[1] for _ in range(runs))
+
+    def test_code_block_conversion_time_is_linear(self):
+        small_time = self.best_parse_time(build_large_code_post(2000))
+        large_time = self.best_parse_time(build_large_code_post(16000))
+
+        # 8x the input should take roughly 8x as long. Quadratic string building takes ~64x, so a loose 24x
+        # bound still catches it without failing on timing noise.
+        self.assertLess(large_time, small_time * 24)
+
+    def test_section_tags_nested_in_code_block(self):
+        mobiledoc, _ = self.parse_timed("<html><body><pre>a<p>x</p>y<br>z</pre><p>After</p></body></html>")
+
+        self.assertEqual(mobiledoc["cards"], [["code", {"code": "axy\nz"}]])
+
+    def test_long_merged_blockquote(self):
+        html = "<html><body>" + "<blockquote>quoted line</blockquote>" * 20000 + "</body></html>"
+
+        mobiledoc, _ = self.parse_timed(html)
+
+        self.assertEqual(len(mobiledoc["sections"]), 1)
+        # Each merged blockquote adds its text plus a soft-return between it and the previous one
+        self.assertEqual(len(mobiledoc["sections"][0][2]), 20000 * 2 - 1)
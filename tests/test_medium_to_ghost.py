@@ -0,0 +1,146 @@
+import unittest
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+from zipfile import ZipFile
+from click.testing import CliRunner
+from medium_to_ghost import medium_to_ghost, logging_config
+
+COMMENT_HTML = '<html><body><h1 class="p-name">A comment</h1><p>Nice post!</p></body></html>'
+
+
+def convert_or_kill_worker(html_filename, post_html_content, image_downloader=None):
+    """
+    Stand-in for convert_medium_post_to_ghost_json() that kills the whole worker process for one post.
+    """
+    if "crash" in html_filename:
+        os._exit(1)
+    # Give the other workers something to be in the middle of when the crash happens
+    time.sleep(0.2)
+    return {"uuid": html_filename}
+
+
+class TestMediumToGhost(unittest.TestCase):
+
+    def tearDown(self):
+        logger = logging.getLogger(logging_config.PACKAGE_LOGGER_NAME)
+        logger.handlers = []
+        logger.propagate = True
+
+    def test_parse_posts_continues_after_a_failed_post(self):
+        posts = {
+            # Filename doesn't follow Medium's date_slug-uuid pattern, so conversion raises
+            "posts/broken.html": COMMENT_HTML,
+            "posts/draft_comment-aaaaaaaaaaaa.html": COMMENT_HTML,
+        }
+
+        with tempfile.TemporaryDirectory() as tmp:
+            error_log = Path(tmp) / "errors.jsonl"
+            listener, _ = logging_config.configure_logging(verbosity=-2, error_log_path=error_log,
+                                                           show_progress=False)
+            converted_posts, failed_posts = medium_to_ghost.parse_posts(posts)
+            listener.stop()
+            listener.handlers[-1].close()
+
+            entries = [json.loads(line) for line in error_log.read_text().splitlines()]
+            failed_post_names = medium_to_ghost.load_failed_post_names(error_log)
+
+        self.assertEqual(converted_posts, [])
+        self.assertEqual(failed_posts, ["posts/broken.html"])
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["kind"], "post")
+        self.assertIn("ValueError", entries[0]["error"])
+        self.assertIn("Traceback", entries[0]["traceback"])
+        self.assertEqual(failed_post_names, {"posts/broken.html"})
+
+    def test_parse_posts_with_workers_continues_after_a_failed_post(self):
+        posts = {
+            "posts/broken.html": COMMENT_HTML,
+            "posts/draft_comment-aaaaaaaaaaaa.html": COMMENT_HTML,
+            "posts/broken-too.html": COMMENT_HTML,
+        }
+
+        with tempfile.TemporaryDirectory() as tmp:
+            error_log = Path(tmp) / "errors.jsonl"
+            log_queue = multiprocessing.Queue()
+            listener, _ = logging_config.configure_logging(verbosity=-2, error_log_path=error_log,
+                                                           show_progress=False, log_queue=log_queue)
+            converted_posts, failed_posts = medium_to_ghost.parse_posts(posts, workers=2, log_queue=log_queue)
+            listener.stop()
+            listener.handlers[-1].close()
+
+            failed_post_names = medium_to_ghost.load_failed_post_names(error_log)
+
+        self.assertEqual(converted_posts, [])
+        self.assertEqual(failed_posts, ["posts/broken.html", "posts/broken-too.html"])
+        self.assertEqual(failed_post_names, {"posts/broken.html", "posts/broken-too.html"})
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == "fork", "workers need to inherit the mocked converter")
+    def test_parse_posts_with_workers_survives_a_worker_dying(self):
+        posts = {f"posts/draft_post{i}-aaaaaaaaaaa{i}.html": COMMENT_HTML for i in range(9)}
+        posts["posts/draft_crash-bbbbbbbbbbbb.html"] = COMMENT_HTML
+        # Run the crashing post early so other posts are still queued and running when its worker dies
+        posts = {name: posts[name] for name in sorted(posts, key=lambda name: "crash" not in name)}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            error_log = Path(tmp) / "errors.jsonl"
+            log_queue = multiprocessing.Queue()
+            listener, _ = logging_config.configure_logging(verbosity=-2, error_log_path=error_log,
+                                                           show_progress=False, log_queue=log_queue)
+            with mock.patch.object(medium_to_ghost, "convert_medium_post_to_ghost_json", convert_or_kill_worker):
+                converted_posts, failed_posts = medium_to_ghost.parse_posts(posts, workers=3, log_queue=log_queue)
+            listener.stop()
+            listener.handlers[-1].close()
+
+            failed_post_names = medium_to_ghost.load_failed_post_names(error_log)
+
+        # Only the post that killed its worker fails. Everything else (including posts that were running in the
+        # other workers at the time) still gets converted, in the original order.
+        self.assertEqual(failed_posts, ["posts/draft_crash-bbbbbbbbbbbb.html"])
+        self.assertEqual(failed_post_names, {"posts/draft_crash-bbbbbbbbbbbb.html"})
+        self.assertEqual([post["uuid"] for post in converted_posts], [name for name in posts if "crash" not in name])
+
+    def test_merge_posts(self):
+        existing_posts = [{"uuid": "a", "title": "A"}, {"uuid": "b", "title": "Old B"}]
+        new_posts = [{"uuid": "b", "title": "New B"}, {"uuid": "c", "title": "C"}]
+
+        merged = medium_to_ghost.merge_posts(existing_posts, new_posts)
+
+        self.assertEqual([post["title"] for post in merged], ["A", "New B", "C"])
+
+    def test_retry_failed_keeps_failures_it_does_not_retry(self):
+        image_failure = {"kind": "image", "url": "https://example.com/a.png", "error": "Not Found"}
+        missing_post_failure = {"kind": "post", "post": "posts/not-in-zip.html", "error": "ValueError: old"}
+        retried_post_failure = {"kind": "post", "post": "posts/broken.html", "error": "ValueError: old"}
+
+        original_cwd = os.getcwd()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, original_cwd)
+        os.chdir(tmp.name)
+
+        with ZipFile("medium-export.zip", "w") as medium_zip:
+            medium_zip.writestr("posts/broken.html", COMMENT_HTML)
+        Path("exported_content").mkdir()
+        with open("exported_content/medium_export_for_ghost.json", "w") as export_file:
+            json.dump(medium_to_ghost.create_export_file([{"uuid": "a"}]), export_file)
+        with open("errors.jsonl", "w") as error_log:
+            for entry in [image_failure, missing_post_failure, retried_post_failure]:
+                error_log.write(json.dumps(entry) + "\n")
+
+        result = CliRunner().invoke(medium_to_ghost.main,
+                                    ["-q", "--error-log", "errors.jsonl", "--retry-failed", "medium-export.zip"])
+
+        entries = medium_to_ghost.load_failures("errors.jsonl")
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(entries[:2], [image_failure, missing_post_failure])
+        # The retried post failed again, so it is logged once, with this run's error
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(entries[2]["post"], "posts/broken.html")
+        self.assertIn("not enough values to unpack", entries[2]["error"])